@@ -0,0 +1,639 @@
+"""Shared helpers for the VM1/VM2 runbooks.
+
+The runbooks historically carried private copies of the same helpers
+(subprocess wrapper, interface/IP discovery, YAML loading, the Grafana
+compose glue). Keeping one copy here means each script parses/compiles the
+code once, bug fixes land in one place, and the lru_cache-based memoization
+actually caches across callers.
+"""
+
+from __future__ import annotations
+
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import io
+import ipaddress
+import mmap
+import os
+import re
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from pathlib import Path
+from typing import Optional
+
+REPO_ROOT = Path(os.path.dirname(os.path.abspath(__file__)))
+
+
+def is_root() -> bool:
+    return hasattr(os, "geteuid") and os.geteuid() == 0
+
+
+# ---------------------------------------------------------------------------
+# Subprocess wrapper
+# ---------------------------------------------------------------------------
+
+def run(
+    cmd: list[str],
+    *,
+    check: bool = True,
+    cwd: Optional[Path] = None,
+    env: Optional[dict] = None,
+    quiet: bool = False,
+    probe: bool = False,
+) -> subprocess.CompletedProcess:
+    """Run a command; with probe=True only the exit status matters.
+
+    Probe calls (e.g. "does `docker compose` exist?") discard the child's
+    output instead of draining it through our stdout, and are bounded by a
+    short timeout so a wedged tool cannot stall setup.
+    """
+    if not quiet and not probe:
+        print(f"[runbook] $ {' '.join(cmd)}", flush=True)
+
+    extra: dict = {}
+    if probe:
+        # close_fds=False (together with no preexec_fn/cwd) lets subprocess
+        # take the os.posix_spawn fast path instead of fork+exec, which
+        # matters once the controller holds many open sockets. Probes are
+        # short-lived tools that never touch our FDs anyway.
+        extra = {
+            "stdout": subprocess.DEVNULL,
+            "stderr": subprocess.DEVNULL,
+            "timeout": 3,
+            "close_fds": False,
+        }
+
+    try:
+        return subprocess.run(cmd, check=check, cwd=str(cwd) if cwd else None, env=env, **extra)
+    except subprocess.TimeoutExpired:
+        if check:
+            raise
+        return subprocess.CompletedProcess(cmd, returncode=124)
+
+
+def run_captured(
+    cmd: list[str],
+    *,
+    check: bool = True,
+    cwd: Optional[Path] = None,
+    env: Optional[dict] = None,
+    stream: bool = False,
+) -> subprocess.CompletedProcess:
+    """Run a command capturing combined output for later error reporting.
+
+    With stream=True (long installs that should show progress), lines are
+    echoed as they arrive and only a bounded tail is retained for error
+    reporting - apt's lock messages land at the end - so peak RSS stays flat
+    no matter how chatty the command is.
+
+    Otherwise capture goes into a file-backed temp instead of a PIPE: apt/pip can emit
+    tens of MB, and a 64KB pipe means syscall ping-pong at best and a stalled
+    child at worst. The child writes raw bytes straight to the fd; they are
+    read back and decoded (explicit UTF-8, never the locale codec, which can
+    choke on package changelogs) only when the command failed - on success
+    stdout is left empty rather than paying to re-read megabytes nobody looks
+    at.
+    """
+    if stream:
+        p = subprocess.Popen(
+            cmd,
+            cwd=str(cwd) if cwd else None,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+        tail: collections.deque[bytes] = collections.deque(maxlen=200)
+        assert p.stdout is not None
+        with p.stdout:
+            for line in p.stdout:
+                sys.stdout.buffer.write(line)
+                tail.append(line)
+        sys.stdout.flush()
+        rc = p.wait()
+        output = b"".join(tail).decode("utf-8", "replace") if rc != 0 else ""
+        cp = subprocess.CompletedProcess(cmd, rc, stdout=output)
+        if check and rc != 0:
+            raise subprocess.CalledProcessError(rc, cmd, output=output)
+        return cp
+
+    with tempfile.TemporaryFile() as out:
+        p = subprocess.run(
+            cmd,
+            cwd=str(cwd) if cwd else None,
+            env=env,
+            stdout=out,
+            stderr=subprocess.STDOUT,
+            bufsize=1 << 16,
+        )
+        if p.returncode != 0:
+            out.seek(0)
+            output = out.read().decode("utf-8", "replace")
+        else:
+            output = ""
+    p = subprocess.CompletedProcess(p.args, p.returncode, stdout=output)
+    if check and p.returncode != 0:
+        raise subprocess.CalledProcessError(p.returncode, cmd, output=p.stdout)
+    return p
+
+
+# ---------------------------------------------------------------------------
+# APT
+# ---------------------------------------------------------------------------
+
+def apt_install(pkgs: list[str], *, max_wait_sec: int = 1200, tag: str = "runbook") -> None:
+    """Install apt packages with lock handling (unattended-upgrades)."""
+    env = os.environ.copy()
+    env["DEBIAN_FRONTEND"] = "noninteractive"
+
+    # Skip translations and let apt retry transient fetch errors itself
+    # instead of bouncing the whole install back to the Python loop. The
+    # Acquire::http pair pipelines package fetches over each mirror
+    # connection instead of one request per response round-trip.
+    apt_opts = [
+        "-o", "Acquire::Languages=none",
+        "-o", "Acquire::Retries=3",
+        "-o", "Acquire::http::Pipeline-Depth=50",
+        "-o", "Acquire::Queue-Mode=access",
+        "-o", "Dpkg::Use-Pty=0",
+    ]
+
+    start = time.time()
+    updated = False
+    while True:
+        try:
+            # One index refresh per setup run: the retry loop below exists for
+            # dpkg lock contention, and re-downloading Packages.gz on every
+            # retry only multiplies the wait.
+            if not updated:
+                run_captured(["apt-get", *apt_opts, "update"], env=env)
+                updated = True
+            run_captured(["apt-get", *apt_opts, "install", "-y", "--no-install-recommends"] + pkgs, env=env, stream=True)
+            return
+        except subprocess.CalledProcessError as e:
+            out = (e.output or "").strip()
+            lock_err = (
+                "Could not get lock" in out
+                or "Unable to acquire the dpkg frontend lock" in out
+                or "is held by process" in out
+                or "dpkg frontend lock" in out
+            )
+            if lock_err:
+                waited = int(time.time() - start)
+                if waited >= max_wait_sec:
+                    print(
+                        f"\n[{tag}] ERROR: APT lock held too long (usually unattended-upgrades).\n"
+                        "Let unattended-upgrades finish, then re-run this runbook.\n"
+                    )
+                    print(out)
+                    raise
+                print(f"[{tag}] APT lock detected. Waiting 10s and retrying... ({waited}s elapsed)")
+                time.sleep(10)
+                continue
+
+            # Non-lock error
+            print(out)
+            raise
+
+
+# ---------------------------------------------------------------------------
+# Project zip extraction
+# ---------------------------------------------------------------------------
+
+class _ZipView(io.RawIOBase):
+    """Independent read-only cursor over one shared mmap of the archive.
+
+    Lets every extraction worker own a ZipFile handle without re-opening the
+    file: all handles read the same mapped pages, and the only per-worker
+    state is this cursor.
+    """
+
+    def __init__(self, mm: mmap.mmap) -> None:
+        self._mm = mm
+        self._pos = 0
+        self._size = len(mm)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        else:
+            self._pos = self._size + offset
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def readinto(self, b) -> int:
+        n = min(len(b), self._size - self._pos)
+        if n <= 0:
+            return 0
+        b[:n] = self._mm[self._pos : self._pos + n]
+        self._pos += n
+        return n
+
+
+def zip_sha256(zip_path: Path) -> str:
+    # Chunked read rather than hashlib.file_digest: that helper is 3.11+,
+    # and Ubuntu 22.04's system python3 is 3.10.
+    h = hashlib.sha256()
+    with zip_path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def extract_zip(zip_path: Path, app_dir: Path, *, tag: str = "runbook") -> None:
+    """Extract a project zip into app_dir, skipping when the zip is unchanged."""
+    if not zip_path.exists():
+        raise FileNotFoundError(f"Missing {zip_path.name} in repo root: {zip_path}")
+
+    # Content-hash gate: re-running setup with an unchanged zip costs one
+    # hash read instead of rmtree + thousands of small writes.
+    marker = app_dir.parent / ".zip.sha256"
+    digest = zip_sha256(zip_path)
+    if app_dir.exists() and marker.exists() and marker.read_text().strip() == digest:
+        print(f"[{tag}] {zip_path.name} unchanged; keeping extracted app dir.")
+        return
+
+    # Extract into a sibling dir and rename over the old tree: the swap is
+    # one syscall instead of N blocking unlinks, a crash mid-extract leaves
+    # the previous tree intact, and the old tree is torn down off the
+    # critical path.
+    final_dir = app_dir
+    new_dir = app_dir.with_name(app_dir.name + ".new")
+    old_dir = app_dir.with_name(app_dir.name + ".old")
+    for leftover in (new_dir, old_dir):
+        if leftover.exists():
+            shutil.rmtree(leftover)
+    app_dir = new_dir
+    app_dir.mkdir(parents=True, exist_ok=True)
+
+    # extractall walks members serially; for many-small-file archives the
+    # wall time is dominated by write-back latency. Extract in worker threads
+    # instead, each with its own ZipFile handle (a shared handle serializes
+    # on an internal lock), after pre-creating all directories to avoid
+    # mkdir races between workers. The archive itself is mapped once and all
+    # worker handles read the same pages through _ZipView cursors.
+    fd = os.open(zip_path, os.O_RDONLY)
+    try:
+        mm = mmap.mmap(fd, 0, prot=mmap.PROT_READ)
+    except (ValueError, OSError):
+        os.close(fd)
+        raise
+    try:
+        with zipfile.ZipFile(io.BufferedReader(_ZipView(mm))) as z:
+            infos = z.infolist()
+
+        files = [i for i in infos if not i.is_dir()]
+        dirs = {i.filename.rstrip("/") for i in infos if i.is_dir()}
+        dirs.update(str(Path(i.filename).parent) for i in files)
+        for d in sorted(dirs, key=lambda d: d.count("/")):
+            if d not in (".", ""):
+                (app_dir / d).mkdir(parents=True, exist_ok=True)
+
+        def _sendfile_stored(info: zipfile.ZipInfo, tgt: Path) -> bool:
+            """Copy a ZIP_STORED member in-kernel; True when fully written.
+
+            Stored members are raw bytes at a known offset, so sendfile can
+            move them file-to-file without the ZipExtFile read/CRC path. The
+            data offset is the local header (30 bytes) plus its variable
+            name/extra fields, which can differ from the central directory's.
+            """
+            name_len, extra_len = struct.unpack_from("<HH", mm, info.header_offset + 26)
+            offset = info.header_offset + 30 + name_len + extra_len
+            remaining = info.file_size
+            dst_fd = os.open(tgt, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                while remaining:
+                    sent = os.sendfile(dst_fd, fd, offset, remaining)
+                    if sent == 0:
+                        return False
+                    offset += sent
+                    remaining -= sent
+            except OSError:
+                return False
+            finally:
+                os.close(dst_fd)
+            return True
+
+        def _worker(chunk: list[zipfile.ZipInfo]) -> None:
+            # Manual copy instead of z.extract: an unbuffered target file
+            # plus a copy buffer bounded by the member size means one
+            # read/write pair for typical small files, and zero-byte members
+            # are just touched. Stored members go through sendfile when the
+            # platform has it; deflated ones still need the Python path.
+            with zipfile.ZipFile(io.BufferedReader(_ZipView(mm))) as z:
+                for info in chunk:
+                    tgt = app_dir / info.filename
+                    if info.file_size == 0:
+                        tgt.touch()
+                        continue
+                    if (
+                        info.compress_type == zipfile.ZIP_STORED
+                        and hasattr(os, "sendfile")
+                        and _sendfile_stored(info, tgt)
+                    ):
+                        continue
+                    with z.open(info) as src, open(tgt, "wb", buffering=0) as dst:
+                        shutil.copyfileobj(src, dst, min(info.file_size, 1 << 20))
+
+        workers = min(os.cpu_count() or 2, 8)
+        step = max(1, len(files) // (workers * 4) or 1)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as ex:
+            futs = [ex.submit(_worker, files[i : i + step]) for i in range(0, len(files), step)]
+            for fut in futs:
+                fut.result()
+    finally:
+        mm.close()
+        os.close(fd)
+
+    if final_dir.exists():
+        os.replace(final_dir, old_dir)
+    os.replace(new_dir, final_dir)
+    if old_dir.exists():
+        threading.Thread(target=shutil.rmtree, args=(old_dir,), kwargs={"ignore_errors": True}, daemon=True).start()
+
+    # Write the marker atomically so a crash mid-write cannot leave a marker
+    # that matches a half-extracted tree.
+    tmp = marker.with_suffix(".sha256.tmp")
+    tmp.write_text(digest)
+    os.replace(tmp, marker)
+
+
+# ---------------------------------------------------------------------------
+# Venv paths
+# ---------------------------------------------------------------------------
+
+def venv_bin(venv_dir: Path, name: str) -> str:
+    return str(venv_dir / "bin" / name)
+
+
+def venv_python(venv_dir: Path) -> str:
+    return venv_bin(venv_dir, "python")
+
+
+# ---------------------------------------------------------------------------
+# Interface / IP discovery
+# ---------------------------------------------------------------------------
+
+# Matches one `ip -o -4 addr show` line: "<idx>: <iface>    inet <ip>/<plen> ..."
+_IP_ADDR_RE = re.compile(r"^\d+:\s+(\S+)\s+inet\s+([0-9.]+)/(\d+)", re.MULTILINE)
+
+
+def _mask_to_plen(netmask: str) -> int:
+    return bin(int.from_bytes(socket.inet_aton(netmask), "big")).count("1")
+
+
+@functools.lru_cache(maxsize=None)
+def _parse_ip_addrs() -> tuple[tuple[str, str, int], ...]:
+    """Return tuple of (iface, ip, prefixlen) for global IPv4 addresses.
+
+    Cached: addresses do not change during a runbook invocation and the
+    subprocess fork is the expensive part.
+    """
+    # In-process path first: psutil wraps getifaddrs(3), so there is no
+    # fork+exec of `ip` and no text output to parse.
+    try:
+        import psutil
+
+        res = [
+            (name, a.address, _mask_to_plen(a.netmask))
+            for name, alist in psutil.net_if_addrs().items()
+            for a in alist
+            if a.family == socket.AF_INET and a.netmask and not a.address.startswith("127.")
+        ]
+        if res:
+            return tuple(res)
+    except Exception:
+        pass
+
+    # Second in-process option: netifaces wraps the same getifaddrs(3) call
+    # and is commonly present on Mininet hosts even when psutil is not.
+    try:
+        import netifaces
+
+        res = [
+            (iface, a["addr"], _mask_to_plen(a["netmask"]))
+            for iface in netifaces.interfaces()
+            for a in netifaces.ifaddresses(iface).get(netifaces.AF_INET, [])
+            if a.get("netmask") and not a["addr"].startswith("127.")
+        ]
+        if res:
+            return tuple(res)
+    except Exception:
+        pass
+
+    try:
+        # A 1 MiB kernel pipe holds the whole response on hosts with many
+        # addresses, so `ip` never blocks mid-write waiting on us to drain.
+        p = subprocess.run(
+            ["ip", "-o", "-4", "addr", "show", "scope", "global"],
+            capture_output=True,
+            text=True,
+            check=True,
+            pipesize=1 << 20,
+        )
+    except Exception:
+        return ()
+    return tuple((m.group(1), m.group(2), int(m.group(3))) for m in _IP_ADDR_RE.finditer(p.stdout))
+
+
+# Advertise-IP preference table, built once at import: (network, netmask, rank)
+# as integers so ranking an address is a handful of int ANDs instead of
+# constructing four IPv4Network objects per call.
+_PREFERRED_NETS = [
+    (int(n.network_address), int(n.netmask), i)
+    for i, n in enumerate(
+        map(
+            ipaddress.ip_network,
+            ("192.168.56.0/24", "192.168.0.0/16", "10.0.0.0/8", "172.16.0.0/12"),
+        )
+    )
+]
+
+
+def _rank_ip(ip: str) -> int:
+    try:
+        ip_int = int(ipaddress.IPv4Address(ip))
+    except Exception:
+        return 999
+    return next((rank for base, mask, rank in _PREFERRED_NETS if (ip_int & mask) == base), 999)
+
+
+@functools.lru_cache(maxsize=None)
+def choose_advertise_ip(prefer_iface: str | None = None) -> str:
+    """Pick the IP a peer VM should use to reach this one.
+
+    Priority:
+      1) interface specified by --prefer-iface
+      2) any IP in 192.168.56.0/24 (the inter-VM network)
+      3) any private RFC1918 address (192.168/16, 10/8, 172.16/12)
+      4) hostname fallback
+    """
+    addrs = _parse_ip_addrs()
+
+    if prefer_iface:
+        for iface, ip, _plen in addrs:
+            if iface == prefer_iface:
+                return ip
+
+    ranked: list[tuple[int, str, str]] = [(_rank_ip(ip), iface, ip) for iface, ip, _plen in addrs]
+    ranked.sort(key=lambda t: (t[0], t[1]))
+    if ranked and ranked[0][0] != 999:
+        return ranked[0][2]
+
+    try:
+        return socket.gethostbyname(socket.gethostname())
+    except Exception:
+        return "127.0.0.1"
+
+
+def _ranked_local_ip() -> Optional[str]:
+    """Best private IPv4 bound locally, ranked by RFC1918 preference."""
+    ranked = sorted((_rank_ip(ip), ip) for _iface, ip, _plen in _parse_ip_addrs())
+    if ranked and ranked[0][0] != 999:
+        return ranked[0][1]
+    return None
+
+
+@functools.lru_cache(maxsize=1)
+def get_primary_ip() -> str:
+    """Best-effort: get the IP address used for default route (cached per run)."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        # connect() on a UDP socket only performs a route lookup, but on
+        # misconfigured hosts even that can stall - keep it bounded.
+        s.settimeout(0.2)
+        s.connect(("8.8.8.8", 80))
+        return s.getsockname()[0]
+    except Exception:
+        # No usable route: fall back to the best-ranked locally bound
+        # private address rather than a useless 127.0.0.1.
+        return _ranked_local_ip() or "127.0.0.1"
+    finally:
+        s.close()
+
+
+# ---------------------------------------------------------------------------
+# YAML config
+# ---------------------------------------------------------------------------
+
+@functools.lru_cache(maxsize=None)
+def load_yaml(path: Path) -> dict:
+    try:
+        import yaml  # installed in venv
+
+        # Prefer the C loader (~10x faster) and stream from the open file
+        # instead of materializing the text first.
+        try:
+            from yaml import CSafeLoader as _Loader
+        except ImportError:
+            from yaml import SafeLoader as _Loader
+
+        with path.open("rb") as f:
+            return yaml.load(f, Loader=_Loader) or {}
+    except Exception:
+        return {}
+
+
+# ---------------------------------------------------------------------------
+# Grafana/Prometheus compose stack
+# ---------------------------------------------------------------------------
+
+# The bundled compose file ships without healthchecks, so `up --wait` would
+# otherwise fall back to compose's slow default probing. Tight start_period/
+# start_interval values make readiness visible within seconds. The override
+# is compose-v2-only: legacy docker-compose 1.x rejects both the missing
+# version: key and the healthcheck shape, and start_interval in particular
+# only exists from compose v2.20.
+_HEALTHCHECK_OVERRIDE = """\
+# Generated by the runbook: fast startup healthchecks for `up --wait`.
+services:
+  prometheus:
+    healthcheck:
+      test: ["CMD-SHELL", "wget -q -O /dev/null http://localhost:9090/-/ready || exit 1"]
+      start_period: 5s
+{start_interval}      interval: 15s
+      retries: 5
+  grafana:
+    healthcheck:
+      test: ["CMD-SHELL", "wget -q -O /dev/null http://localhost:3000/api/health || exit 1"]
+      start_period: 5s
+{start_interval}      interval: 15s
+      retries: 5
+"""
+
+
+def _compose_plugin_version(docker: str) -> Optional[tuple[int, int]]:
+    """(major, minor) of the `docker compose` plugin, or None if absent."""
+    try:
+        out = subprocess.run(
+            [docker, "compose", "version", "--short"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            timeout=3,
+        )
+    except Exception:
+        return None
+    if out.returncode != 0:
+        return None
+    m = re.match(r"v?(\d+)\.(\d+)", out.stdout.strip())
+    return (int(m.group(1)), int(m.group(2))) if m else None
+
+
+def write_healthcheck_override(compose_dir: Path, *, start_interval: bool = True) -> Path:
+    override = compose_dir / "docker-compose.override.yml"
+    body = _HEALTHCHECK_OVERRIDE.format(
+        start_interval="      start_interval: 1s\n" if start_interval else ""
+    )
+    # Rewrite on content change so a plugin up/downgrade fixes a stale file.
+    if not override.exists() or override.read_text(encoding="utf-8") != body:
+        override.write_text(body, encoding="utf-8")
+    return override
+
+
+def docker_compose_up(compose_dir: Path) -> bool:
+    """Start Prometheus+Grafana if Docker is available."""
+    docker = shutil.which("docker")
+    if not docker:
+        print("[runbook] Docker not found; skipping Prometheus/Grafana containers.", flush=True)
+        return False
+
+    # Try both: `docker compose` (plugin) and legacy `docker-compose`.
+    plugin_version = _compose_plugin_version(docker)
+    if plugin_version is not None:
+        print("[runbook] Starting Prometheus+Grafana (docker compose)...", flush=True)
+        override = write_healthcheck_override(compose_dir, start_interval=plugin_version >= (2, 20))
+        run(
+            [docker, "compose", "-f", "docker-compose.yml", "-f", override.name,
+             "up", "-d", "--wait", "--wait-timeout", "60"],
+            cwd=compose_dir,
+        )
+        return True
+
+    if shutil.which("docker-compose"):
+        # Legacy 1.x: no --wait, and it rejects the override's schema, so run
+        # the bundled file as-is.
+        print("[runbook] Starting Prometheus+Grafana (docker-compose, legacy)...", flush=True)
+        run(["docker-compose", "up", "-d"], cwd=compose_dir)
+        return True
+
+    print("[runbook] Docker Compose not found; skipping Prometheus/Grafana containers.", flush=True)
+    return False
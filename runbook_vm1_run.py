@@ -19,133 +19,29 @@ Optional:
 from __future__ import annotations
 
 import argparse
-import ipaddress
 import os
-import socket
+import signal
 import subprocess
-import sys
-import time
 from pathlib import Path
 
-REPO_ROOT = Path(__file__).resolve().parent
+from runbook_common import choose_advertise_ip, docker_compose_up, load_yaml, venv_bin, venv_python
+
+REPO_ROOT = Path(os.path.dirname(os.path.abspath(__file__)))
 DEPLOY_DIR = REPO_ROOT / ".deploy" / "vm1_controller"
 APP_DIR = DEPLOY_DIR / "app"
 CONF_PATH = DEPLOY_DIR / "config" / "default.yaml"
 VENV_DIR = DEPLOY_DIR / ".venv"
 
 
-def run(cmd: list[str], *, check: bool = True, cwd: Path | None = None, env: dict | None = None) -> subprocess.CompletedProcess:
-    p = subprocess.run(cmd, cwd=str(cwd) if cwd else None, env=env, text=True)
-    if check and p.returncode != 0:
-        raise subprocess.CalledProcessError(p.returncode, cmd)
-    return p
-
-
-def venv_bin(name: str) -> str:
-    return str(VENV_DIR / "bin" / name)
-
-
-def venv_python() -> str:
-    return venv_bin("python")
-
-
-def _parse_ip_addrs() -> list[tuple[str, str, int]]:
-    """Return list of (iface, ip, prefixlen) for global IPv4 addresses."""
-    try:
-        out = subprocess.check_output(["ip", "-o", "-4", "addr", "show", "scope", "global"], text=True)
-    except Exception:
-        return []
-    res: list[tuple[str, str, int]] = []
-    for line in out.splitlines():
-        parts = line.split()
-        if len(parts) < 4:
-            continue
-        iface = parts[1]
-        inet = parts[3]
-        if "/" not in inet:
-            continue
-        ip, plen = inet.split("/", 1)
-        try:
-            res.append((iface, ip, int(plen)))
-        except Exception:
-            continue
-    return res
-
-
-def choose_advertise_ip(prefer_iface: str | None = None) -> str:
-    """Pick the IP VM2 should use to reach VM1.
-
-    Priority:
-      1) interface specified by --prefer-iface
-      2) any IP in 192.168.56.0/24 (your inter-VM network)
-      3) any private RFC1918 address (192.168/16, 10/8, 172.16/12)
-      4) hostname fallback
-    """
-    addrs = _parse_ip_addrs()
-
-    if prefer_iface:
-        for iface, ip, _plen in addrs:
-            if iface == prefer_iface:
-                return ip
-
-    preferred_nets = [
-        ipaddress.ip_network("192.168.56.0/24"),
-        ipaddress.ip_network("192.168.0.0/16"),
-        ipaddress.ip_network("10.0.0.0/8"),
-        ipaddress.ip_network("172.16.0.0/12"),
-    ]
-
-    ranked: list[tuple[int, str, str]] = []
-    for iface, ip, _plen in addrs:
-        try:
-            ip_obj = ipaddress.ip_address(ip)
-        except Exception:
-            continue
-        rank = 999
-        for i, net in enumerate(preferred_nets):
-            if ip_obj in net:
-                rank = i
-                break
-        ranked.append((rank, iface, ip))
-
-    ranked.sort(key=lambda t: (t[0], t[1]))
-    if ranked and ranked[0][0] != 999:
-        return ranked[0][2]
-
-    try:
-        return socket.gethostbyname(socket.gethostname())
-    except Exception:
-        return "127.0.0.1"
-
-
-def load_yaml(path: Path) -> dict:
-    try:
-        import yaml  # installed in venv
-
-        return yaml.safe_load(path.read_text(encoding="utf-8")) or {}
-    except Exception:
-        return {}
-
-
 def start_grafana_stack() -> None:
     docker_dir = APP_DIR / "docker"
-    compose = docker_dir / "docker-compose.yml"
-    if not compose.exists():
+    if not (docker_dir / "docker-compose.yml").exists():
         print("[vm1-run] No docker-compose.yml inside the controller project; skipping Grafana/Prometheus stack.")
         return
 
-    # Try docker-compose, then docker compose
     try:
-        run(["docker-compose", "-f", str(compose), "up", "-d"], cwd=docker_dir)
-        print("[vm1-run] Grafana/Prometheus started via docker-compose.")
-        return
-    except Exception:
-        pass
-
-    try:
-        run(["docker", "compose", "-f", str(compose), "up", "-d"], cwd=docker_dir)
-        print("[vm1-run] Grafana/Prometheus started via docker compose.")
-        return
+        if docker_compose_up(docker_dir):
+            print("[vm1-run] Grafana/Prometheus started.")
     except Exception as e:
         print("[vm1-run] Could not start Grafana/Prometheus. Ensure docker is installed and running.")
         print(f"          Error: {e}")
@@ -186,18 +82,28 @@ def main() -> None:
     if args.with_grafana:
         start_grafana_stack()
 
-    env = os.environ.copy()
-    env["PYTHONPATH"] = str(APP_DIR) + (":" + env["PYTHONPATH"] if env.get("PYTHONPATH") else "")
-    env["HYBRID_LB_CONFIG"] = str(CONF_PATH)
-
-    osken_mgr = Path(venv_bin("osken-manager"))
+    # Minimal child environment instead of a full os.environ copy: the manager
+    # only needs PATH/HOME/locale plus our own variables. The PYTHON* knobs
+    # skip per-start .pyc writes in the venv and keep hashing reproducible.
+    inherited_pythonpath = os.environ.get("PYTHONPATH", "")
+    env = {
+        "PATH": os.environ.get("PATH", ""),
+        "HOME": os.environ.get("HOME", ""),
+        "LANG": os.environ.get("LANG", "C.UTF-8"),
+        "PYTHONPATH": str(APP_DIR) + (":" + inherited_pythonpath if inherited_pythonpath else ""),
+        "HYBRID_LB_CONFIG": str(CONF_PATH),
+        "PYTHONDONTWRITEBYTECODE": "1",
+        "PYTHONHASHSEED": "0",
+    }
+
+    osken_mgr = Path(venv_bin(VENV_DIR, "osken-manager"))
     # In some environments the console_script wrapper is missing even when os-ken is installed.
     # We can always launch the manager via `python -m os_ken.cmd.manager`.
     mgr_prefix: list[str]
     if osken_mgr.exists():
         mgr_prefix = [str(osken_mgr)]
     else:
-        mgr_prefix = [venv_python(), "-m", "os_ken.cmd.manager"]
+        mgr_prefix = [venv_python(VENV_DIR), "-m", "os_ken.cmd.manager"]
         print("[vm1-run] WARNING: osken-manager script not found; using python -m os_ken.cmd.manager instead.")
 
     cmd = [
@@ -225,18 +131,21 @@ def main() -> None:
     print("\n[vm1-run] Stop with Ctrl+C\n")
 
     # Foreground
+    p = subprocess.Popen(cmd, env=env, cwd=str(APP_DIR))
+
+    # Make `systemctl stop` (SIGTERM) behave like Ctrl+C: forward to the child.
+    signal.signal(signal.SIGTERM, lambda *_: p.terminate())
+
     try:
-        p = subprocess.Popen(cmd, env=env, cwd=str(APP_DIR))
-        while True:
-            rc = p.poll()
-            if rc is not None:
-                raise SystemExit(rc)
-            time.sleep(1)
+        # Block in wait() instead of a poll/sleep loop: no periodic wakeups
+        # and exit/Ctrl+C are handled immediately.
+        raise SystemExit(p.wait())
     except KeyboardInterrupt:
         pass
     finally:
         try:
             p.terminate()
+            p.wait(timeout=5)
         except Exception:
             pass
 
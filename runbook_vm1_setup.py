@@ -17,88 +17,19 @@ Optional:
 from __future__ import annotations
 
 import argparse
+import hashlib
 import os
-import shutil
 import subprocess
-import sys
-import time
-import zipfile
 from pathlib import Path
 
-REPO_ROOT = Path(__file__).resolve().parent
+REPO_ROOT = Path(os.path.dirname(os.path.abspath(__file__)))
 ZIP_NAME = "vm1_controller_project.zip"
 DEPLOY_DIR = REPO_ROOT / ".deploy" / "vm1_controller"
 APP_DIR = DEPLOY_DIR / "app"
 CONF_DIR = DEPLOY_DIR / "config"
 VENV_DIR = DEPLOY_DIR / ".venv"
 
-
-def is_root() -> bool:
-    return hasattr(os, "geteuid") and os.geteuid() == 0
-
-
-def run(cmd: list[str], *, check: bool = True, cwd: Path | None = None, env: dict | None = None) -> subprocess.CompletedProcess:
-    p = subprocess.run(
-        cmd,
-        cwd=str(cwd) if cwd else None,
-        env=env,
-        text=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-    )
-    if check and p.returncode != 0:
-        raise subprocess.CalledProcessError(p.returncode, cmd, output=p.stdout)
-    return p
-
-
-def apt_install(pkgs: list[str], *, max_wait_sec: int = 1200) -> None:
-    """Install apt packages with lock handling (unattended-upgrades)."""
-    env = os.environ.copy()
-    env["DEBIAN_FRONTEND"] = "noninteractive"
-
-    start = time.time()
-    while True:
-        try:
-            run(["apt-get", "update"], env=env)
-            run(["apt-get", "install", "-y"] + pkgs, env=env)
-            return
-        except subprocess.CalledProcessError as e:
-            out = (e.output or "").strip()
-            lock_err = (
-                "Could not get lock" in out
-                or "Unable to acquire the dpkg frontend lock" in out
-                or "is held by process" in out
-                or "dpkg frontend lock" in out
-            )
-            if lock_err:
-                waited = int(time.time() - start)
-                if waited >= max_wait_sec:
-                    print(
-                        "\n[vm1-setup] ERROR: APT lock held too long (usually unattended-upgrades).\n"
-                        "Let unattended-upgrades finish, then re-run this runbook.\n"
-                    )
-                    print(out)
-                    raise
-                print(f"[vm1-setup] APT lock detected. Waiting 10s and retrying... ({waited}s elapsed)")
-                time.sleep(10)
-                continue
-
-            # Non-lock error
-            print(out)
-            raise
-
-
-def extract_zip() -> None:
-    zip_path = REPO_ROOT / ZIP_NAME
-    if not zip_path.exists():
-        raise FileNotFoundError(f"Missing {ZIP_NAME} in repo root: {zip_path}")
-
-    if APP_DIR.exists():
-        shutil.rmtree(APP_DIR)
-    APP_DIR.mkdir(parents=True, exist_ok=True)
-
-    with zipfile.ZipFile(zip_path, "r") as z:
-        z.extractall(APP_DIR)
+PIP_CACHE_DIR = REPO_ROOT / ".deploy" / ".pip-cache"
 
 
 def copy_default_config() -> None:
@@ -117,17 +48,26 @@ def copy_default_config() -> None:
 
 
 def ensure_venv(python_bin: str = "python3") -> None:
+    # runbook_common is imported inside the helpers (and main) rather than at
+    # module top: it pulls in mmap, zipfile, hashlib and friends, which
+    # --help and bad-args invocations never need.
+    from runbook_common import run_captured as run
+
     if VENV_DIR.exists():
         return
     run([python_bin, "-m", "venv", str(VENV_DIR)])
 
 
 def venv_python() -> str:
-    return str(VENV_DIR / "bin" / "python")
+    import runbook_common
+
+    return runbook_common.venv_python(VENV_DIR)
 
 
 def venv_bin(name: str) -> str:
-    return str(VENV_DIR / "bin" / name)
+    import runbook_common
+
+    return runbook_common.venv_bin(VENV_DIR, name)
 
 
 def ensure_osken_manager_wrapper() -> None:
@@ -142,6 +82,8 @@ def ensure_osken_manager_wrapper() -> None:
     when missing.
     """
 
+    from runbook_common import run_captured as run
+
     osken_mgr = Path(venv_bin("osken-manager"))
     if osken_mgr.exists():
         return
@@ -166,8 +108,17 @@ if __name__ == '__main__':
 
 
 def pip_install(args: list[str]) -> None:
+    from runbook_common import run_captured as run
+
     py = venv_python()
-    cmd = [py, "-m", "pip"] + args
+    # A pinned cache dir survives venv re-creation, so re-runs reuse the
+    # downloaded wheels. --prefer-binary avoids sdist builds, --no-compile
+    # skips the py_compile sweep (the run script sets
+    # PYTHONDONTWRITEBYTECODE anyway), and skipping the version self-check
+    # saves a network round-trip per invocation.
+    cmd = [py, "-m", "pip", "--cache-dir", str(PIP_CACHE_DIR), "--disable-pip-version-check"] + args
+    if args and args[0] == "install":
+        cmd += ["--prefer-binary", "--no-compile"]
     try:
         run(cmd)
     except subprocess.CalledProcessError as e:
@@ -180,12 +131,25 @@ def main() -> None:
     ap.add_argument("--with-grafana", action="store_true", help="Also install Docker + Compose for Grafana/Prometheus.")
     args = ap.parse_args()
 
+    from runbook_common import apt_install, extract_zip, is_root
+
     if not is_root():
         print("[vm1-setup] Please run as root:\n  sudo -E python3 runbook_vm1_setup.py")
         raise SystemExit(1)
 
     (REPO_ROOT / ".deploy").mkdir(exist_ok=True)
 
+    # Extraction is disk-bound and independent of apt, which is network-bound
+    # and can take minutes; run it in the background and collect the result
+    # (or its exception) once apt and the venv are done.
+    import concurrent.futures
+
+    DEPLOY_DIR.mkdir(parents=True, exist_ok=True)
+    print("[vm1-setup] Extracting controller project zip (in background)...")
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    extract_fut = pool.submit(lambda: (extract_zip(REPO_ROOT / ZIP_NAME, APP_DIR, tag="vm1-setup"), copy_default_config()))
+    pool.shutdown(wait=False)
+
     print("[vm1-setup] Installing OS dependencies (APT lock-safe)...")
     pkgs = [
         "python3-venv",
@@ -199,25 +163,37 @@ def main() -> None:
     ]
     if args.with_grafana:
         pkgs += ["docker.io", "docker-compose"]
-    apt_install(pkgs)
-
-    print("[vm1-setup] Extracting controller project zip...")
-    DEPLOY_DIR.mkdir(parents=True, exist_ok=True)
-    extract_zip()
-    copy_default_config()
+    apt_install(pkgs, tag="vm1-setup")
 
     print("[vm1-setup] Creating venv...")
     ensure_venv("python3")
 
-    print("[vm1-setup] Upgrading pip tooling...")
-    pip_install(["install", "--upgrade", "pip", "setuptools", "wheel"])
+    # Everything past this point reads from the extracted app dir.
+    extract_fut.result()
+
+    # Stamps turn steady-state re-runs of the two pip steps into a stat():
+    # the tooling upgrade once it has happened in this venv, the
+    # requirements install as long as requirements.txt is unchanged.
+    tooling_stamp = VENV_DIR / ".tooling.stamp"
+    if tooling_stamp.exists():
+        print("[vm1-setup] pip tooling already upgraded; skipping.")
+    else:
+        print("[vm1-setup] Upgrading pip tooling...")
+        pip_install(["install", "--upgrade", "pip", "setuptools", "wheel"])
+        tooling_stamp.write_text("pip,setuptools,wheel upgraded\n")
 
     req = APP_DIR / "requirements.txt"
     if not req.exists():
         raise FileNotFoundError(f"Missing requirements.txt inside zip at {req}")
 
-    print("[vm1-setup] Installing Python requirements...")
-    pip_install(["install", "-r", str(req)])
+    req_digest = hashlib.sha256(req.read_bytes()).hexdigest()
+    reqs_stamp = VENV_DIR / ".reqs.sha256"
+    if reqs_stamp.exists() and reqs_stamp.read_text().strip() == req_digest:
+        print("[vm1-setup] requirements.txt unchanged; skipping pip install.")
+    else:
+        print("[vm1-setup] Installing Python requirements...")
+        pip_install(["install", "-r", str(req)])
+        reqs_stamp.write_text(req_digest)
 
     # Make sure we can run the controller even if console scripts were not generated.
     ensure_osken_manager_wrapper()
@@ -23,14 +23,11 @@ import socket
 import subprocess
 import sys
 import time
-import urllib.error
-import urllib.request
-import zipfile
 from pathlib import Path
 from typing import Optional, Tuple
 
 
-REPO_DIR = Path(__file__).resolve().parent
+REPO_DIR = Path(os.path.dirname(os.path.abspath(__file__)))
 ZIP_NAME_DEFAULT = "vm2_dataplane_project.zip"
 
 DISCOVER_PATH = "/discover"
@@ -59,13 +56,17 @@ def ensure_apt(pkgs: list[str]) -> None:
 
 
 def extract_zip(zip_path: Path, dest_dir: Path) -> None:
-    if dest_dir.exists() and any(dest_dir.iterdir()):
-        print(f"[runbook:vm2] Using existing extracted dir: {dest_dir}", flush=True)
-        return
-    dest_dir.mkdir(parents=True, exist_ok=True)
+    # Imported here rather than at module top: runbook_common pulls in mmap,
+    # zipfile, hashlib and friends, which is pure dead weight for invocations
+    # that never get past argparse (--help, bad args, non-root exit).
+    import runbook_common
+
     print(f"[runbook:vm2] Extracting {zip_path} -> {dest_dir}", flush=True)
-    with zipfile.ZipFile(zip_path, "r") as zf:
-        zf.extractall(dest_dir)
+    # Shared extractor: thread-pool workers over one mmap of the archive,
+    # with a sha256 marker that skips the whole step when the zip is
+    # unchanged (stricter than the old "dir is non-empty" check, which kept
+    # stale trees after a zip update).
+    runbook_common.extract_zip(zip_path, dest_dir, tag="runbook:vm2")
 
 
 def get_primary_ip_and_cidr() -> Tuple[str, str]:
@@ -85,29 +86,101 @@ def get_primary_ip_and_cidr() -> Tuple[str, str]:
     return ip, cidr
 
 
+# One shared urllib3 pool for all probes (if urllib3 is available): avoids
+# rebuilding opener/handler chains per call and reuses the connection to a
+# confirmed host for the follow-up verification fetch. urllib stays as the
+# stdlib-only fallback.
+try:
+    import urllib3
+
+    _HTTP: Optional["urllib3.PoolManager"] = urllib3.PoolManager(num_pools=1, maxsize=64, retries=False)
+except ImportError:
+    _HTTP = None
+
+
 def try_discover(ip: str, rest_port: int, timeout: float = 0.25) -> Optional[dict]:
     url = f"http://{ip}:{rest_port}{DISCOVER_PATH}"
+    if _HTTP is not None:
+        try:
+            r = _HTTP.request(
+                "GET",
+                url,
+                headers={"User-Agent": "hybrid-lb-discovery"},
+                timeout=urllib3.Timeout(connect=timeout, read=max(timeout, 0.5)),
+            )
+            return json.loads(r.data) if r.status == 200 else None
+        except Exception:
+            return None
     try:
+        import urllib.request
+
         req = urllib.request.Request(url, headers={"Connection": "close", "User-Agent": "hybrid-lb-discovery"})
         with urllib.request.urlopen(req, timeout=timeout) as resp:
             raw = resp.read()
-        return json.loads(raw.decode("utf-8"))
+        # json.loads accepts bytes directly; skipping the intermediate str
+        # avoids one copy of the body per probe.
+        return json.loads(raw)
     except Exception:
         return None
 
 
+def _live_hosts(net: ipaddress.IPv4Network) -> list[str]:
+    """Hosts in `net` with a complete ARP entry - known-alive neighbours."""
+    hosts: list[str] = []
+    try:
+        with open("/proc/net/arp", encoding="ascii") as f:
+            next(f)  # header row
+            for line in f:
+                parts = line.split()
+                if len(parts) < 4:
+                    continue
+                ip, flags = parts[0], parts[2]
+                try:
+                    if int(flags, 16) & 0x2 and ipaddress.IPv4Address(ip) in net:
+                        hosts.append(ip)
+                except ValueError:
+                    continue
+    except OSError:
+        pass
+    return hosts
+
+
 def discover_controller(rest_port: int, cidr: str) -> Tuple[str, dict]:
+    import concurrent.futures
+
     net = ipaddress.ip_network(cidr, strict=False)
     print(f"[runbook:vm2] Auto-discovery: scanning {net} for controller REST on port {rest_port} ...", flush=True)
 
-    # Simple linear scan. For /24 this is fast enough.
-    for host in net.hosts():
-        ip = str(host)
-        payload = try_discover(ip, rest_port=rest_port, timeout=0.2)
+    # ARP fast path: neighbours the kernel has already resolved are the only
+    # hosts that can realistically be the controller, so probe those few
+    # first and only fall back to the full sweep if none answer.
+    for ip in _live_hosts(net):
+        payload = try_discover(ip, rest_port=rest_port, timeout=0.25)
         if payload and "controller" in payload and "vip" in payload:
-            print(f"[runbook:vm2] Found controller at {ip}:{rest_port}", flush=True)
+            print(f"[runbook:vm2] Found controller at {ip}:{rest_port} (ARP cache)", flush=True)
             return ip, payload
 
+    # Parallel scan: a serial sweep costs up to 254 * timeout (~50s) per /24,
+    # while overlapping the waits collapses it to roughly one timeout window.
+    # setdefaulttimeout backstops urllib in case a probe stalls mid-connect;
+    # it is global interpreter state, so restore it once the scan is done.
+    prev_timeout = socket.getdefaulttimeout()
+    socket.setdefaulttimeout(1.0)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=96) as ex:
+            futures = {ex.submit(try_discover, str(h), rest_port, 0.25): str(h) for h in net.hosts()}
+            try:
+                for fut in concurrent.futures.as_completed(futures):
+                    payload = fut.result()
+                    if payload and "controller" in payload and "vip" in payload:
+                        ip = futures[fut]
+                        print(f"[runbook:vm2] Found controller at {ip}:{rest_port}", flush=True)
+                        return ip, payload
+            finally:
+                ex.shutdown(wait=False, cancel_futures=True)
+    finally:
+        socket.setdefaulttimeout(prev_timeout)
+
     raise RuntimeError(f"Controller not found in {cidr}. Provide --controller-ip or set CONTROLLER_IP env var.")
 
 
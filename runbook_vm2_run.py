@@ -17,34 +17,94 @@ If auto-discovery fails, specify the controller IP manually:
 from __future__ import annotations
 
 import argparse
-import concurrent.futures
+import asyncio
+import functools
 import ipaddress
+import itertools
 import json
 import os
 import socket
+import struct
 import subprocess
 import sys
 import time
 from pathlib import Path
-from urllib.request import urlopen
 
-REPO_ROOT = Path(__file__).resolve().parent
+REPO_ROOT = Path(os.path.dirname(os.path.abspath(__file__)))
 DEPLOY_DIR = REPO_ROOT / ".deploy" / "vm2_dataplane"
 APP_DIR = DEPLOY_DIR / "app"
+# Precomputed once: the existence check is a single stat on this string
+# rather than Path allocation + parent resolution per call.
+TOPO_PATH = str(APP_DIR / "topology" / "mininet_stack.py")
 
 DEFAULT_REST_PORT = 8080
 
+# Cached constructors: the same address/network strings come back repeatedly
+# (ARP rows across nets, the inter-VM /24, shrunken scan nets), and parsing
+# dominates the cost of these objects.
+_ip_address = functools.lru_cache(maxsize=256)(ipaddress.ip_address)
+_ip_network = functools.lru_cache(maxsize=64)(ipaddress.ip_network)
+
 
 def is_root() -> bool:
     return hasattr(os, "geteuid") and os.geteuid() == 0
 
 
-def _parse_ip_addrs() -> list[tuple[str, str, int]]:
-    """Return list of (iface, ip, prefixlen) for global IPv4 addresses."""
+def _mask_to_plen(netmask: str) -> int:
+    return bin(int.from_bytes(socket.inet_aton(netmask), "big")).count("1")
+
+
+@functools.lru_cache(maxsize=1)
+def _parse_ip_addrs() -> tuple[tuple[str, str, int], ...]:
+    """Return tuple of (iface, ip, prefixlen) for global IPv4 addresses.
+
+    Cached: addresses do not change during a runbook invocation and the
+    subprocess fork is the expensive part.
+    """
+    # In-process path first: psutil wraps getifaddrs(3), so there is no
+    # fork+exec of `ip` and no text output to parse.
     try:
-        out = subprocess.check_output(["ip", "-o", "-4", "addr", "show", "scope", "global"], text=True)
+        import psutil
+
+        res = [
+            (name, a.address, _mask_to_plen(a.netmask))
+            for name, alist in psutil.net_if_addrs().items()
+            for a in alist
+            if a.family == socket.AF_INET and a.netmask and not a.address.startswith("127.")
+        ]
+        if res:
+            return tuple(res)
     except Exception:
-        return []
+        pass
+
+    # Second in-process option: netifaces wraps the same getifaddrs(3) call
+    # and is commonly present on Mininet hosts even when psutil is not.
+    try:
+        import netifaces
+
+        res = [
+            (iface, a["addr"], _mask_to_plen(a["netmask"]))
+            for iface in netifaces.interfaces()
+            for a in netifaces.ifaddresses(iface).get(netifaces.AF_INET, [])
+            if a.get("netmask") and not a["addr"].startswith("127.")
+        ]
+        if res:
+            return tuple(res)
+    except Exception:
+        pass
+
+    try:
+        # A 1 MiB kernel pipe holds the whole response on hosts with many
+        # addresses, so `ip` never blocks mid-write waiting on us to drain.
+        out = subprocess.run(
+            ["ip", "-o", "-4", "addr", "show", "scope", "global"],
+            capture_output=True,
+            text=True,
+            check=True,
+            pipesize=1 << 20,
+        ).stdout
+    except Exception:
+        return ()
 
     res: list[tuple[str, str, int]] = []
     for line in out.splitlines():
@@ -60,7 +120,22 @@ def _parse_ip_addrs() -> list[tuple[str, str, int]]:
             res.append((iface, ip, int(plen)))
         except Exception:
             continue
-    return res
+    return tuple(res)
+
+
+# Preference table built once at import: (first, last, rank) integer bounds
+# per preferred net. _net_rank is a sort key, so it fires O(n log n) times;
+# two int compares per row beat constructing four IPv4Network objects and
+# running subnet_of each call.
+_PREFERRED_NETS = [
+    (int(n.network_address), int(n.broadcast_address), rank)
+    for rank, n in enumerate(
+        map(
+            ipaddress.ip_network,
+            ("192.168.56.0/24", "192.168.0.0/16", "10.0.0.0/8", "172.16.0.0/12"),
+        )
+    )
+]
 
 
 def _net_rank(net: ipaddress.IPv4Network) -> tuple[int, int]:
@@ -74,20 +149,14 @@ def _net_rank(net: ipaddress.IPv4Network) -> tuple[int, int]:
 
     Second key: prefer /24 or smaller scans.
     """
-    if net.subnet_of(ipaddress.ip_network("192.168.56.0/24")) or net == ipaddress.ip_network("192.168.56.0/24"):
-        p = 0
-    elif net.subnet_of(ipaddress.ip_network("192.168.0.0/16")):
-        p = 1
-    elif net.subnet_of(ipaddress.ip_network("10.0.0.0/8")):
-        p = 2
-    elif net.subnet_of(ipaddress.ip_network("172.16.0.0/12")):
-        p = 3
-    else:
-        p = 9
+    first = int(net.network_address)
+    last = int(net.broadcast_address)
+    p = next((rank for base, top, rank in _PREFERRED_NETS if base <= first and last <= top), 9)
     return (p, net.prefixlen)
 
 
-def candidate_networks() -> list[ipaddress.IPv4Network]:
+@functools.lru_cache(maxsize=1)
+def candidate_networks() -> tuple[ipaddress.IPv4Network, ...]:
     nets: list[ipaddress.IPv4Network] = []
     for _iface, ip, plen in _parse_ip_addrs():
         try:
@@ -97,61 +166,252 @@ def candidate_networks() -> list[ipaddress.IPv4Network]:
             net = ipi.network
             # Avoid scanning very large nets; shrink to /24.
             if net.prefixlen < 24:
-                net = ipaddress.ip_network(f"{ip}/24", strict=False)
+                net = _ip_network(f"{ip}/24", strict=False)
             nets.append(net)
         except Exception:
             continue
 
     # Always include the expected inter-VM network first (even if not bound),
     # because VirtualBox host-only typically uses 192.168.56.0/24.
-    nets.append(ipaddress.ip_network("192.168.56.0/24"))
+    nets.append(_ip_network("192.168.56.0/24"))
+
+    # dict.fromkeys dedupes without losing discovery order, so ties under
+    # _net_rank keep the interface enumeration order instead of whatever
+    # iteration order the set hash happens to produce.
+    uniq = sorted(dict.fromkeys(nets), key=_net_rank)
+    return tuple(uniq[:4])
+
+
+async def _probe_discover(
+    ip: str,
+    rest_port: int,
+    connect_timeout: float = 0.15,
+    read_timeout: float = 1.0,
+) -> tuple[str, dict] | None:
+    """Probe one host: connect and issue GET /discover on the same socket.
+
+    Folding the HTTP request into the connect avoids the old two-phase
+    TCP-probe-then-urlopen dance (two handshakes and two RTTs per host).
+
+    The socket is created by hand so kernel-side bounds apply before the
+    connect: TCP_USER_TIMEOUT caps how long the stack itself waits on an
+    unresponsive peer, and SO_LINGER(1, 0) makes close() send RST instead of
+    FIN, so hundreds of failed probes do not pile up in TIME_WAIT.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        if hasattr(socket, "TCP_USER_TIMEOUT"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT, 250)
+    except OSError:
+        pass
 
-    uniq = sorted(set(nets), key=_net_rank)
-    return uniq[:4]
+    try:
+        loop = asyncio.get_running_loop()
+        await asyncio.wait_for(loop.sock_connect(sock, (ip, rest_port)), timeout=connect_timeout)
+        reader, writer = await asyncio.open_connection(sock=sock)
+    except Exception:
+        sock.close()
+        return None
+    except BaseException:
+        # CancelledError is a BaseException: _scan_hosts cancels every
+        # in-flight probe the moment one wins, and the fd must be released
+        # here rather than whenever GC gets around to it.
+        sock.close()
+        raise
 
+    try:
+        writer.write(
+            f"GET /discover HTTP/1.0\r\nHost: {ip}\r\nConnection: close\r\n\r\n".encode("ascii")
+        )
+        await writer.drain()
+        raw = await asyncio.wait_for(reader.read(), timeout=read_timeout)
+    except Exception:
+        return None
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+    head, _, body = raw.partition(b"\r\n\r\n")
+    status_line = head.split(b"\r\n", 1)[0]
+    if not status_line.startswith(b"HTTP/") or b" 200" not in status_line:
+        return None
+
+    # Cheap sniff before parsing: on busy nets plenty of hosts serve *some*
+    # 200 on this port (proxies, dev servers), and a C-level substring scan
+    # rejects those far cheaper than a failed json.loads would.
+    if b'"controller"' not in body or b'"vip"' not in body:
+        return None
 
-def _tcp_open(ip: str, port: int, timeout: float = 0.25) -> bool:
     try:
-        with socket.create_connection((ip, port), timeout=timeout):
-            return True
+        data = json.loads(body)
     except Exception:
-        return False
+        return None
+
+    # Expected shape from HybridLBRestController.discovery_payload():
+    # {"vip": {...}, "controller": {...}}
+    if isinstance(data, dict) and "controller" in data and "vip" in data:
+        return ip, data
+    return None
+
+
+def _live_hosts(net: ipaddress.IPv4Network) -> list[str]:
+    """Hosts in `net` with a complete ARP entry - known-alive neighbours.
+
+    The kernel already knows which addresses answered recently; reading
+    /proc/net/arp costs one file read and typically shrinks discovery to a
+    handful of probes before any sweep is needed.
+    """
+    hosts: list[str] = []
+    try:
+        with open("/proc/net/arp", encoding="ascii") as f:
+            next(f)  # header row
+            for line in f:
+                parts = line.split()
+                if len(parts) < 4:
+                    continue
+                ip, flags = parts[0], parts[2]
+                try:
+                    if int(flags, 16) & 0x2 and _ip_address(ip) in net:
+                        hosts.append(ip)
+                except ValueError:
+                    continue
+    except OSError:
+        pass
+    return hosts
+
 
+def _int_to_ip(a: int) -> str:
+    return f"{a >> 24 & 255}.{a >> 16 & 255}.{a >> 8 & 255}.{a & 255}"
 
-def _fetch_discover(ip: str, rest_port: int, timeout: float = 1.0) -> dict | None:
+
+def _host_ips(net: ipaddress.IPv4Network) -> list[str]:
+    """Dotted-quad host addresses of `net` without IPv4Address churn.
+
+    net.hosts() allocates a full IPv4Address object per host only for us to
+    str() it away; formatting straight from the integer range sidesteps a
+    thousand short-lived objects on a multi-net scan.
+    """
+    base = int(net.network_address)
+    last = int(net.broadcast_address)
+    if net.prefixlen >= 31:
+        return [_int_to_ip(a) for a in range(base, last + 1)]
+    return [_int_to_ip(a) for a in range(base + 1, last)]
+
+
+def _priority_ips(net: ipaddress.IPv4Network) -> list[str]:
+    """The "usual suspect" addresses for a net: gateway/DHCP/server slots."""
+    base = int(net.network_address)
+    last = int(net.broadcast_address)
+    return [_int_to_ip(base + off) for off in (1, 2, 10, 100, 254) if base + off < last]
+
+
+def _ordered_scan_ips(nets: tuple[ipaddress.IPv4Network, ...]) -> list[str]:
+    """Flatten candidate nets into one probe order, best guesses first.
+
+    Priority slots of every net come before any full sweep, so on a typical
+    deployment (controller at .1/.2/.10 of the inter-VM net) the answer
+    arrives within the first handful of probes instead of after a /24 sweep.
+    dict.fromkeys dedupes while preserving that order; the tiers are chained
+    lazily into it so no intermediate per-tier list is built. Our own
+    addresses are dropped - probing ourselves is a guaranteed miss that
+    still burns a timeout slot.
+    """
+    own_ips = {ip for _iface, ip, _plen in _parse_ip_addrs()}
+    return [
+        ip
+        for ip in dict.fromkeys(
+            itertools.chain(
+                (ip for net in nets for ip in _live_hosts(net)),
+                (ip for net in nets for ip in _priority_ips(net)),
+                (ip for net in nets for ip in _host_ips(net)),
+            )
+        )
+        if ip not in own_ips
+    ]
+
+
+async def _scan_hosts(ips: list[str], rest_port: int) -> tuple[str, dict] | None:
+    """Race /discover probes over an ordered IP list; first valid payload wins.
+
+    A semaphore bounds in-flight connects so a multi-net scan cannot open
+    ~1000 sockets at once; probes are still launched in list order, so the
+    priority addresses go out in the first batch.
+    """
+    sem = asyncio.Semaphore(128)
+
+    async def bounded(ip: str) -> tuple[str, dict] | None:
+        async with sem:
+            return await _probe_discover(ip, rest_port)
+
+    tasks = [asyncio.ensure_future(bounded(ip)) for ip in ips]
     try:
-        with urlopen(f"http://{ip}:{rest_port}/discover", timeout=timeout) as r:
-            data = json.loads(r.read().decode("utf-8"))
-        # Expected shape from HybridLBRestController.discovery_payload():
-        # {"vip": {...}, "controller": {...}}
-        if isinstance(data, dict) and "controller" in data and "vip" in data:
-            return data
+        for fut in asyncio.as_completed(tasks):
+            hit = await fut
+            if hit:
+                return hit
+        return None
+    finally:
+        # Stop wasted work the moment a controller is found (or scan fails).
+        for t in tasks:
+            t.cancel()
+
+
+CACHE_PATH = REPO_ROOT / ".deploy" / "discovery.cache.json"
+CACHE_MAX_AGE = 3600.0
+
+
+def _cached_controller(rest_port: int) -> tuple[str, dict] | None:
+    """Re-verify the last discovered controller with a single probe.
+
+    Controllers rarely move between runs; one probe against the cached IP
+    turns the usual scan into a ~50ms verify. Any failure (stale file,
+    moved controller, bad JSON) just falls through to the full scan.
+    """
+    try:
+        cached = json.loads(CACHE_PATH.read_text())
+        ip = cached["ip"]
+        if time.time() - float(cached["ts"]) > CACHE_MAX_AGE:
+            raise ValueError("cache expired")
     except Exception:
         return None
+
+    hit = asyncio.run(_probe_discover(ip, rest_port, connect_timeout=0.5))
+    if hit:
+        print(f"[vm2-run] Cached controller {ip} verified; skipping scan.")
+        return hit
+    CACHE_PATH.unlink(missing_ok=True)
     return None
 
 
+def _store_discovery(ip: str, payload: dict) -> None:
+    try:
+        CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp = CACHE_PATH.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps({"ip": ip, "payload": payload, "ts": time.time()}))
+        os.replace(tmp, CACHE_PATH)
+    except OSError:
+        pass
+
+
 def discover_controller(rest_port: int = DEFAULT_REST_PORT) -> tuple[str, dict]:
     """Find a controller REST endpoint by scanning candidate networks."""
-    nets = candidate_networks()
-    for net in nets:
-        hosts = [str(h) for h in net.hosts()]
-        print(f"[vm2-run] Scanning {net} for controller REST on port {rest_port} ...")
-
-        # Parallel TCP scan
-        with concurrent.futures.ThreadPoolExecutor(max_workers=96) as ex:
-            futs = {ex.submit(_tcp_open, ip, rest_port): ip for ip in hosts}
-            for fut in concurrent.futures.as_completed(futs):
-                ip = futs[fut]
-                try:
-                    if not fut.result():
-                        continue
-                except Exception:
-                    continue
+    hit = _cached_controller(rest_port)
+    if hit:
+        return hit
 
-                payload = _fetch_discover(ip, rest_port)
-                if payload:
-                    return ip, payload
+    nets = candidate_networks()
+    ips = _ordered_scan_ips(nets)
+    print(f"[vm2-run] Scanning {', '.join(map(str, nets))} for controller REST on port {rest_port} ...")
+    hit = asyncio.run(_scan_hosts(ips, rest_port))
+    if hit:
+        _store_discovery(*hit)
+        return hit
 
     raise RuntimeError(
         "Controller discovery failed. Provide --controller-ip <VM1_IP> or verify VM1 REST is reachable."
@@ -181,8 +441,7 @@ def main() -> None:
         print("[vm2-run] Please run as root (Mininet requires it):\n  sudo -E python3 runbook_vm2_run.py")
         raise SystemExit(1)
 
-    topo = APP_DIR / "topology" / "mininet_stack.py"
-    if not topo.exists():
+    if not os.path.isfile(TOPO_PATH):
         print("[vm2-run] Missing deployment. Run setup first:\n  sudo -E python3 runbook_vm2_setup.py")
         raise SystemExit(1)
 
@@ -222,7 +481,7 @@ def main() -> None:
 
     cmd = [
         "python3",
-        str(topo),
+        TOPO_PATH,
         "--controller-ip",
         controller_ip,
         "--controller-port",